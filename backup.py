@@ -1,15 +1,29 @@
 #!/usr/bin/env python3.6
 import argparse
+import configparser
+import json
 import logging
 import os
 from os import listdir
 import random
+import re
+import shlex
+import shutil
 import string
 import subprocess
 import sys
+import threading
+import time
+from collections import deque
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 from typing import List
 
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
 # Configuration of backup script start
 #   Name of backup user
 BACKUP_USER = "cumnsee_backup"
@@ -31,6 +45,8 @@ FULL_BACKUP_FOLDER_NAME = "full"
 INCREMENTAL_FOLDER_NAME_PREFIX = "inc"
 #   Number of threads for backup
 PARALLEL_THREAD_NUM = 1
+#   Number of parallel mysqlbinlog processes to decode binary logs
+BINLOG_DECODE_THREAD_NUM = 4
 #   Enable SELinux (Set 0 to disable)
 ENABLE_SELINUX = False
 #   Folder with MySQL bin log files
@@ -40,11 +56,94 @@ MYSQL_DB_PATH = "/var/lib/mysql"
 MYSQL_HOST = "127.0.0.1"
 MYSQL_PORT = "3306"
 MYSQL_USER = "root"
+#   File with state of current operation (JSON) for other tools, updated with progress
+STATUS_FILE = "/tmp/backup_mysql_status.json"
+#   Interval (in seconds) between progress messages
+PROGRESS_INTERVAL = 30
+#   File with measured throughput of finished operations (JSON lines), used to estimate duration
+PROGRESS_HISTORY_FILE = "/var/log/backup_mysql_history.log"
+#   Number of last finished operations to estimate throughput
+PROGRESS_HISTORY_NUM = 10
+#   Free space (in percent of estimated size) which should stay on target filesystem after operation
+PREFLIGHT_FREE_SPACE_MARGIN = 10
+#   Refuse backup or restore if it does not fit free space (False - only warn)
+PREFLIGHT_ENFORCE = True
+#   Save InnoDB buffer pool page list with every backup and load it after restoration.
+#   BACKUP_USER needs privilege to set global variables for it (SUPER or SYSTEM_VARIABLES_ADMIN in MariaDB 10.5.2+)
+BUFFER_POOL_DUMP = True
+#   Name of InnoDB buffer pool dump file (innodb_buffer_pool_filename)
+BUFFER_POOL_FILE_NAME = "ib_buffer_pool"
+#   Max time (in seconds) to wait for InnoDB buffer pool dump or load
+BUFFER_POOL_TIMEOUT = 3600
+#   Backup profiles for groups of databases with own schedule and retention, whole instance is backed up if empty.
+#   Every profile is stored in own folder BACKUP_BASE_DIR/<profile name>.
+#   databases - list of databases for backup (mariabackup --databases), they are restored as a whole;
+#   full_backup_day - day of full backup (1 - 7), incremental - do daily incremental backups;
+#   copy_num - number of saved full backups;
+#   base - profile with backup of whole instance without databases of other profiles (databases are not used),
+#   it is restored first, then databases of other profiles are created from their schema and tables are imported
+#   as transportable tablespaces. Only one profile should be base.
+#   BACKUP_USER needs privileges for mysqldump --no-data of profile databases.
+BACKUP_PROFILES = {
+    # "main": {"base": True, "full_backup_day": 1, "incremental": True, "copy_num": 2},
+    # "archive": {"databases": ["archive"], "full_backup_day": 7, "incremental": False, "copy_num": 4},
+}
+#   Name of file with schema of profile databases in backup folder
+PROFILE_SCHEMA_FILE_NAME = "schema.sql"
+#   Encrypt backups and dumps with AES-256-GCM in chunks (python package "cryptography" is required)
+ENCRYPTION = False
+#   File with encryption key, 64 hex characters (make it with "openssl rand -hex 32")
+ENCRYPTION_KEY_FILE = "/etc/my.cnf.d/.backup_key"
+#   Size of encrypted chunk in bytes
+ENCRYPTION_CHUNK_SIZE = 4194304
+#   Number of threads for encryption and decryption
+ENCRYPTION_THREAD_NUM = 4
+#   Restore mode:
+#   clone - restore from clone of backup (cp --reflink or parallel copy if reflink is not supported), backup
+#   stays intact. Backup is restored in place if RESTORE_CLONE_DIR is not on filesystem of MYSQL_DB_PATH
+#   in_place - prepare stored backup itself and rename it after restoration
+RESTORE_MODE = "clone"
+#   Folder for clones of backups during restoration, should be on same filesystem as BACKUP_BASE_DIR
+#   and MYSQL_DB_PATH (reflink and move of restored files without copy)
+RESTORE_CLONE_DIR = "/mnt/blockstorage/restore"
 
 # Configuration of backup script end
 
 
 BACKUP_TOOL = "/usr/bin/mariabackup"
+STREAM_TOOL = "/usr/bin/mbstream"
+ENCRYPTED_BACKUP_FILE_NAME = "backup.xbstream.enc"
+ENCRYPTED_FILE_SUFFIX = ".enc"
+ENCRYPTION_MAGIC = b"MBSENC01"
+ENCRYPTION_HEADER_SIZE = 20
+ENCRYPTION_REPORT = "Encryption cost"
+#   Number of last output lines of command with progress which are logged if command is failed
+COMMAND_OUTPUT_LINES_NUM = 20
+#   Settings passed to encryption stage of pipelines, they can be changed after config file is read
+ENCRYPTION_SETTINGS = ("ENCRYPTION_KEY_FILE", "ENCRYPTION_CHUNK_SIZE", "ENCRYPTION_THREAD_NUM", "PROGRESS_HISTORY_FILE")
+#   Options of operations from config file profile and command line, missed options are asked from stdin
+OPTIONS = {}
+#   Batch jobs from config file sections [job:<name>]
+JOBS = {}
+OPTION_NAMES = {
+    "backup": "Backup folder to restore or \"latest\" (backup_<profile> for backup profiles).",
+    "apply_binlog": "Apply MySQL binary logs after restore (yes or no).",
+    "damage_time": "Time when database was damaged, like 2018-07-15T19:27:00.",
+    "password": "Password of MYSQL_USER.",
+    "password_file": "File with password of MYSQL_USER.",
+    "source_db": "Name of source database (copy, export).",
+    "target_db": "Name of target database (copy, import).",
+    "export_folder": "Folder for dump file (export).",
+    "dump_file": "Dump file to import.",
+    "db_host": "Database host to import dump.",
+    "db_port": "Database port to import dump.",
+    "db_user": "Database user to import dump.",
+    "db_pass": "Password of database user to import dump.",
+    "db_key": "Database key (16 characters) to import dump.",
+    "jobs": "Comma separated names of batch jobs (all jobs from config file if not set).",
+    "workers": "Number of batch jobs running at the same time.",
+}
+YES_ANSWERS = ("y", "yes", "true", "on", "1")
 
 
 def datetime_in_custom_format():
@@ -54,11 +153,26 @@ def datetime_in_custom_format():
 def read_args():
     parser = argparse.ArgumentParser(description="Tool to create MySQL backup and restore it. "
                                                  "Supported actions - backup, restore, copy, export "
-                                                 "and import databases.")
+                                                 "and import databases, batch of copy, export and import. "
+                                                 "Options which are not set in config file or command line "
+                                                 "are asked from stdin.")
     parser.add_argument("-a", "--action", type=str, help="Script action. Supported next operations: "
-                                                         "backup, restore, copy, export and import.", required=True)
+                                                         "backup, restore, copy, export, import, batch, "
+                                                         "encrypt and decrypt (stdin to stdout).",
+                        required=True)
     parser.add_argument("-l", "--log_level", type=str, help="Set log level (INFO, DEBUG, WARNING, ERROR).",
                         required=False, default="INFO")
+    parser.add_argument("-c", "--config", type=str, help="Config file with settings, profiles and batch jobs.",
+                        required=False)
+    parser.add_argument("-p", "--profile", type=str, help="Name of profile (section) in config file.",
+                        required=False)
+    parser.add_argument("-s", "--set", type=str, action="append", default=[],
+                        help="Override setting of this script, like ENCRYPTION_THREAD_NUM=8 (can be repeated).")
+    parser.add_argument("-y", "--yes", action="store_true", help="Answer yes to all confirmations.")
+    parser.add_argument("--no_input", action="store_true",
+                        help="Never ask from stdin, fail if required option is missed.")
+    for x, text in OPTION_NAMES.items():
+        parser.add_argument(f"--{x}", type=str, required=False, help=text)
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
         sys.exit(1)
@@ -85,6 +199,55 @@ def configure_logger(arguments):
         raise Exception(f"Can't recognize log level: {arguments.log_level}")
 
 
+def apply_setting(key, value):
+    current = globals().get(key)
+    if key.startswith("_") or not isinstance(current, (str, int, bool, dict, list)):
+        raise Exception(f"Unknown setting: {key}")
+    if isinstance(current, bool):
+        value = value.lower() in YES_ANSWERS
+    elif isinstance(current, int):
+        value = int(value)
+    elif isinstance(current, (dict, list)):
+        value = json.loads(value)
+    logging.debug("apply_setting - %s", key)
+    globals()[key] = value
+
+
+def load_options(arguments):
+    if arguments.config is not None:
+        parser = configparser.ConfigParser(interpolation=None)
+        parser.optionxform = str
+        if len(parser.read(arguments.config)) == 0:
+            raise Exception(f"Can't read config file: {arguments.config}")
+        if arguments.profile is None:
+            section = parser.defaults()
+        elif parser.has_section(arguments.profile):
+            section = parser[arguments.profile]
+        else:
+            raise Exception(f"Can't find profile \"{arguments.profile}\" in config file {arguments.config}")
+        # Upper case keys override settings of this script, lower case keys are options of operations
+        for key, value in section.items():
+            if key.isupper():
+                apply_setting(key, value)
+            else:
+                OPTIONS[key] = value
+        for x in parser.sections():
+            if x.startswith("job:"):
+                JOBS[x[4:]] = {key: value for key, value in parser[x].items() if not key.isupper()}
+    for x in arguments.set:
+        if "=" not in x:
+            raise Exception(f"Setting should be in format KEY=VALUE: {x}")
+        key, value = x.split("=", 1)
+        apply_setting(key, value)
+    for x in OPTION_NAMES:
+        if getattr(arguments, x) is not None:
+            OPTIONS[x] = getattr(arguments, x)
+    if arguments.yes is True:
+        OPTIONS["yes"] = "yes"
+    if arguments.no_input is True:
+        OPTIONS["no_input"] = "yes"
+
+
 def get_day_of_week():
     today = get_today()
     today_id = today.isoweekday()
@@ -134,32 +297,100 @@ def is_backup_done(full: bool, path):
 
 
 def remove_old_backup():
-    logging.debug("Remove extra backups, older %s weeks", FULL_BACKUP_COPY_NUM)
+    copy_num = get_profile_option("copy_num", FULL_BACKUP_COPY_NUM)
+    logging.debug("Remove extra backups, older %s weeks", copy_num)
     existed = get_exists_backups()
     logging.debug("remove_old_backup.existed - %s", existed)
-    for_del_raw = existed[: -1 * FULL_BACKUP_COPY_NUM]
+    for_del_raw = existed[: -1 * copy_num]
     for x in for_del_raw:
-        cmd = f"rm -rf {BACKUP_BASE_DIR}/{x}"
+        cmd = f"rm -rf {get_backup_base_dir()}/{x}"
         logging.debug("remove_old_backup.cmd - %s", cmd)
         execute_command(cmd.split(" "))
 
 
 def do_backup():
-    if TODAY_DAY_OF_WEEK == FULL_BACKUP_DAY:
+    incremental = get_profile_option("incremental", True)
+    if TODAY_DAY_OF_WEEK == get_profile_option("full_backup_day", FULL_BACKUP_DAY):
         logging.info("Today is day of full backup. Do full backup first.")
-        do_full_backup()
-        do_incremental_backup()
-    else:
+        if do_full_backup() is False:
+            return False
+        if incremental is True:
+            return do_incremental_backup()
+    elif incremental is True:
         logging.info("Today is not day of full backup. Do incremental backup only.")
-        do_incremental_backup()
+        return do_incremental_backup()
+    elif is_backup_done(full=True, path=FULL_BACKUP_PATH) is False:
+        logging.info("Full backup for this week not exists. Do full backup.")
+        return do_full_backup()
+    else:
+        logging.info("Today is not day of full backup and incremental backups are disabled. Skip backup.")
+    return True
+
+
+def get_days_from_full_backup():
+    return (TODAY_DAY_OF_WEEK - get_profile_option("full_backup_day", FULL_BACKUP_DAY)) % 7
 
 
 def get_full_backup_date():
-    return str(get_today().date() - timedelta(days=(TODAY_DAY_OF_WEEK - 1)))
+    return str(get_today().date() - timedelta(days=get_days_from_full_backup()))
+
 
+def get_profile_option(key, default):
+    return BACKUP_PROFILES.get(BACKUP_PROFILE_NAME, {}).get(key, default)
 
-def read_password_from_file():
-    with open(BACKUP_PASSWORD_FILE) as f:
+
+def get_backup_profile_names():
+    if len(BACKUP_PROFILES) == 0:
+        return [""]
+    return list(BACKUP_PROFILES)
+
+
+def is_base_profile(name):
+    return BACKUP_PROFILES.get(name, {}).get("base", False) is True
+
+
+def get_base_profile_name():
+    for name in BACKUP_PROFILES:
+        if is_base_profile(name):
+            return name
+    logging.error("Base backup profile not found in BACKUP_PROFILES")
+    return ""
+
+
+def check_backup_profiles():
+    if len(BACKUP_PROFILES) == 0:
+        return True
+    base = [x for x in BACKUP_PROFILES if is_base_profile(x)]
+    if len(base) != 1:
+        logging.error("BACKUP_PROFILES should have exactly one base profile, found: %s", base)
+        return False
+    for name in BACKUP_PROFILES:
+        if name not in base and len(BACKUP_PROFILES[name].get("databases", [])) == 0:
+            logging.error("Backup profile \"%s\" has no databases", name)
+            return False
+    return True
+
+
+def get_backup_base_dir():
+    if len(BACKUP_PROFILE_NAME) == 0:
+        return BACKUP_BASE_DIR
+    return f"{BACKUP_BASE_DIR}/{BACKUP_PROFILE_NAME}"
+
+
+def use_backup_profile(name):
+    global BACKUP_PROFILE_NAME, WEEKLY_BACKUP_PATH, FULL_BACKUP_PATH, INC_BACKUP_PATH_CURRENT, \
+        INC_BACKUP_PATH_PREVIOUS
+    BACKUP_PROFILE_NAME = name
+    if len(name) > 0:
+        logging.info("Use backup profile \"%s\"", name)
+    WEEKLY_BACKUP_PATH = f"{get_backup_base_dir()}/{FULL_BACKUP_PREFIX}{get_full_backup_date()}"
+    FULL_BACKUP_PATH = get_full_backup_path()
+    INC_BACKUP_PATH_CURRENT = get_incremental_backup_path()
+    INC_BACKUP_PATH_PREVIOUS = get_previous_incremental_backup_path()
+
+
+def read_password_from_file(path=""):
+    with open(path if len(path) > 0 else BACKUP_PASSWORD_FILE) as f:
         a = str(f.readline())
         if a[len(a) - 1] == "\n":
             return a[:-1]
@@ -176,30 +407,531 @@ def make_backup_command(target_dir, from_dir=""):
 
     if len(from_dir) == 0:
         res = __make_command()
-        res = res.split(" ")
+        res = res.split(" ") + make_backup_filter()
         logging.debug("Backup command (list) - %s", res)
         return res
     else:
         res = f"{__make_command()} --incremental-basedir={from_dir}"
-        res = res.split(" ")
+        res = res.split(" ") + make_backup_filter()
         logging.debug("Backup command (list) - %s", res)
         return res
 
 
-def execute_command(command: List):
-    return subprocess.Popen(command, stdout=subprocess.PIPE).wait()
+def get_profile_databases():
+    if is_base_profile(BACKUP_PROFILE_NAME):
+        return []
+    return get_profile_option("databases", [])
+
+
+def get_excluded_databases():
+    if is_base_profile(BACKUP_PROFILE_NAME) is False:
+        return []
+    # Databases of other profiles are skipped in base backup, system tablespace still has their tables,
+    # so they are dropped and created from schema of profile on restore
+    return [x for name, profile in BACKUP_PROFILES.items() if name != BACKUP_PROFILE_NAME
+            for x in profile.get("databases", [])]
+
+
+def make_backup_filter():
+    res = []
+    databases = get_profile_databases()
+    if len(databases) > 0:
+        res.append(f"--databases={' '.join(databases)}")
+    excluded = get_excluded_databases()
+    if len(excluded) > 0:
+        res.append(f"--databases-exclude={' '.join(excluded)}")
+    return res
+
+
+def save_profile_schema(target_backup):
+    databases = get_profile_databases()
+    if len(databases) == 0:
+        return
+    cmd = f"/usr/bin/mysqldump --user={BACKUP_USER} --host={MYSQL_HOST} --port={MYSQL_PORT} " \
+          f"--password={read_password_from_file()} --no-data --routines --events --triggers " \
+          f"--databases {' '.join(databases)}"
+    if ENCRYPTION is True:
+        cmd += f" | {make_encryption_stage('encrypt')} > {target_backup}/{PROFILE_SCHEMA_FILE_NAME}" \
+               f"{ENCRYPTED_FILE_SUFFIX}"
+    else:
+        cmd += f" > {target_backup}/{PROFILE_SCHEMA_FILE_NAME}"
+    logging.debug("save_profile_schema - %s", target_backup)
+    f_name = __make_temp_bash()
+    if execute_command_in_bash(command=cmd, f_name=f_name) != 0:
+        logging.error("Can't save schema of databases %s to %s", databases, target_backup)
+    os.remove(f_name)
+
+
+def read_checkpoints(path):
+    info = f"{path}/xtrabackup_checkpoints"
+    res = {}
+    if os.path.exists(info) is False:
+        return res
+    for x in read_backup_info(info):
+        if " = " in x:
+            key, value = x.split(" = ", 1)
+            res[key] = value
+    return res
+
+
+def dir_size(path):
+    size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            f = os.path.join(root, name)
+            if os.path.isfile(f) and not os.path.islink(f):
+                size += os.path.getsize(f)
+    return size
+
+
+def format_progress_value(value, unit):
+    if unit == "bytes":
+        return f"{value / 1024 / 1024:.1f} MB"
+    return f"{int(value)} {unit}"
+
+
+def save_history(operation, size, seconds):
+    try:
+        with open(PROGRESS_HISTORY_FILE, "a") as f:
+            f.write(json.dumps({"operation": operation, "bytes": size, "seconds": round(seconds, 1),
+                                "finished": datetime.now().isoformat(timespec="seconds")}) + "\n")
+    except OSError as e:
+        logging.warning("Can't save history to %s - %s", PROGRESS_HISTORY_FILE, e)
+
+
+def read_history(operation):
+    if os.path.exists(PROGRESS_HISTORY_FILE) is False:
+        return []
+    with open(PROGRESS_HISTORY_FILE) as f:
+        records = [json.loads(x) for x in f if len(x.strip()) > 0]
+    return [x for x in records if x.get("operation") == operation][-1 * PROGRESS_HISTORY_NUM:]
+
+
+def get_throughput(operation):
+    records = read_history(operation)
+    seconds = sum(x["seconds"] for x in records)
+    if seconds <= 0:
+        return 0
+    return sum(x["bytes"] for x in records) / seconds
+
+
+def save_status(status):
+    tmp = f"{STATUS_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(status, f)
+    os.replace(tmp, STATUS_FILE)
+
+
+class Progress:
+    def __init__(self, stage, total, unit="bytes", parser=None, target_dir="", offset=0, sizes=None):
+        self.stage = stage
+        self.total = max(total, 0)
+        self.unit = unit
+        self.parser = parser
+        self.target_dir = target_dir
+        self.offset = offset
+        self.sizes = sizes if sizes is not None else {}
+        self.current = ""
+        self.done = 0
+        self.state = "running"
+        self.started = time.time()
+        self.reported = 0.0
+
+    def parse(self, line):
+        if self.parser is not None:
+            self.parser(self, line)
+
+    def advance(self, value):
+        self.update(self.done + value)
+
+    def update(self, done, force=False):
+        self.done = max(done, self.done)
+        self.report(force=force)
+
+    def finish(self, code):
+        self.state = "done" if code == 0 else "failed"
+        if code == 0:
+            # Written size is saved to history, estimate of incremental backup is made from it
+            self.done = dir_size(self.target_dir) if len(self.target_dir) > 0 else max(self.total, self.done)
+        self.report(force=True)
+        if code == 0 and self.unit == "bytes":
+            save_history(operation=self.stage.split(" ")[0], size=self.done, seconds=time.time() - self.started)
+
+    def report(self, force=False):
+        now = time.time()
+        if force is False and now - self.reported < PROGRESS_INTERVAL:
+            return
+        self.reported = now
+        elapsed = max(now - self.started, 0.001)
+        speed = self.done / elapsed
+        percent = min(100.0, 100.0 * self.done / self.total) if self.total > 0 else 0.0
+        eta = (self.total - self.done) / speed if speed > 0 and self.total > self.done else 0
+        logging.info("%s: %s, %.1f%% (%s of %s), %s/s, ETA %s", self.stage, self.state, percent,
+                     format_progress_value(self.done, self.unit), format_progress_value(self.total, self.unit),
+                     format_progress_value(speed, self.unit), timedelta(seconds=int(eta)))
+        try:
+            save_status({"stage": self.stage, "state": self.state, "percent": round(percent, 1),
+                         "done": self.done, "total": self.total, "unit": self.unit, "speed": round(speed, 1),
+                         "eta_seconds": int(eta), "elapsed_seconds": int(elapsed), "pid": os.getpid(),
+                         "updated": datetime.fromtimestamp(now).isoformat(timespec="seconds")})
+        except OSError as e:
+            logging.warning("Can't save status to %s - %s", STATUS_FILE, e)
+
+
+BACKUP_TOOL_LSN_RE = re.compile(r"(?:log scanned up to \(|log sequence number )(\d+)")
+MYSQLDUMP_TABLE_RE = re.compile(r"-- Retrieving table structure for table (\S+?)\.\.\.")
+
+
+def parse_backup_tool_line(progress, line):
+    m = BACKUP_TOOL_LSN_RE.search(line)
+    if m is not None and progress.unit == "lsn":
+        progress.update(int(m.group(1)) - progress.offset)
+
+
+def parse_mysqldump_line(progress, line):
+    m = MYSQLDUMP_TABLE_RE.search(line)
+    if m is not None:
+        progress.advance(progress.sizes.get(progress.current, 0))
+        progress.current = m.group(1).strip("`")
+
+
+def watch_target_size(progress, process):
+    # Backup tool writes nothing while large file is copied, so size of target is polled until process is finished
+    while True:
+        try:
+            process.wait(timeout=PROGRESS_INTERVAL)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+        try:
+            progress.update(dir_size(progress.target_dir), force=True)
+        except OSError as e:
+            logging.debug("watch_target_size - %s", e)
+
+
+def execute_command(command: List, progress=None):
+    if progress is None:
+        return subprocess.Popen(command, stdout=subprocess.PIPE).wait()
+    p = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    watcher = None
+    if len(progress.target_dir) > 0:
+        watcher = threading.Thread(target=watch_target_size, args=(progress, p), daemon=True)
+        watcher.start()
+    # Output is logged at debug level only, last lines of it explain error of failed command
+    last_lines = deque(maxlen=COMMAND_OUTPUT_LINES_NUM)
+    for line in p.stderr:
+        if ENCRYPTION_REPORT in line:
+            logging.info(line.rstrip())
+        logging.debug("%s: %s", progress.stage, line.rstrip())
+        last_lines.append(line.rstrip())
+        progress.parse(line)
+    code = p.wait()
+    if watcher is not None:
+        watcher.join()
+    if code != 0:
+        logging.error("%s is failed with code %s, last output:\n%s", progress.stage, code, "\n".join(last_lines))
+    progress.finish(code)
+    return code
+
+
+def read_encryption_key():
+    if AESGCM is None:
+        raise Exception("Python package \"cryptography\" is required for encryption")
+    with open(ENCRYPTION_KEY_FILE) as f:
+        key = bytes.fromhex(f.readline().strip())
+    if len(key) != 32:
+        raise Exception(f"Encryption key in {ENCRYPTION_KEY_FILE} should be 64 hex characters")
+    return key
+
+
+def make_encryption_stage(action):
+    cmd = [sys.executable, os.path.abspath(__file__), "-a", action,
+           "-l", logging.getLevelName(logging.getLogger().level)]
+    for x in ENCRYPTION_SETTINGS:
+        cmd += ["-s", f"{x}={globals()[x]}"]
+    return " ".join(shlex.quote(x) for x in cmd)
+
+
+def read_full(source, size):
+    data = b""
+    while len(data) < size:
+        a = source.read(size - len(data))
+        if len(a) == 0:
+            break
+        data += a
+    return data
+
+
+def make_chunk_nonce(header, counter, final):
+    # Nonce is unique per stream and chunk, final flag in associated data detects truncated stream
+    nonce = header[12:ENCRYPTION_HEADER_SIZE] + counter.to_bytes(4, "big")
+    aad = header + counter.to_bytes(8, "big") + (b"\x01" if final is True else b"\x00")
+    return nonce, aad
+
+
+def read_plain_chunks(source, size):
+    chunk = read_full(source, size)
+    while True:
+        next_chunk = read_full(source, size) if len(chunk) == size else b""
+        yield chunk, len(next_chunk) == 0
+        if len(next_chunk) == 0:
+            return
+        chunk = next_chunk
+
+
+def read_encrypted_chunks(source, chunk_size):
+    length = read_full(source, 4)
+    while len(length) == 4:
+        if int.from_bytes(length, "big") > chunk_size + 16:
+            raise Exception("Wrong size of encrypted chunk")
+        data = read_full(source, int.from_bytes(length, "big"))
+        next_length = read_full(source, 4)
+        yield data, len(next_length) == 0
+        length = next_length
+    if len(length) > 0:
+        raise Exception("Encrypted stream is truncated")
+
+
+def write_chunk(target, data, encrypted):
+    if encrypted is True:
+        target.write(len(data).to_bytes(4, "big"))
+    target.write(data)
+
+
+def transform_stream(action, source, target, key):
+    encrypt = action == "encrypt"
+    if encrypt is True:
+        header = ENCRYPTION_MAGIC + ENCRYPTION_CHUNK_SIZE.to_bytes(4, "big") + os.urandom(8)
+        target.write(header)
+        chunks = read_plain_chunks(source, ENCRYPTION_CHUNK_SIZE)
+    else:
+        header = read_full(source, ENCRYPTION_HEADER_SIZE)
+        if len(header) != ENCRYPTION_HEADER_SIZE or header[:8] != ENCRYPTION_MAGIC:
+            raise Exception("Wrong format of encrypted stream")
+        chunks = read_encrypted_chunks(source, int.from_bytes(header[8:12], "big"))
+    aes = AESGCM(key)
+    func = aes.encrypt if encrypt is True else aes.decrypt
+    threads = max(1, ENCRYPTION_THREAD_NUM)
+    started = time.time()
+    cpu_started = time.process_time()
+    size = 0
+    counter = 0
+    # Chunks are processed in parallel and written in order, number of chunks in memory is limited by window size
+    pending = deque()
+    with ThreadPool(threads) as pool:
+        for data, final in chunks:
+            nonce, aad = make_chunk_nonce(header, counter, final)
+            pending.append(pool.apply_async(func, (nonce, data, aad)))
+            size += len(data)
+            counter += 1
+            if len(pending) >= 2 * threads:
+                write_chunk(target, pending.popleft().get(), encrypted=encrypt)
+        while len(pending) > 0:
+            write_chunk(target, pending.popleft().get(), encrypted=encrypt)
+    target.flush()
+    if counter == 0:
+        raise Exception("Encrypted stream is truncated")
+
+    elapsed = max(time.time() - started, 0.001)
+    logging.info("%s: %s %s in %.1f sec (%s/s), CPU time %.1f sec", ENCRYPTION_REPORT, action,
+                 format_progress_value(size, "bytes"), elapsed, format_progress_value(size / elapsed, "bytes"),
+                 time.process_time() - cpu_started)
+    save_history(operation=action, size=size, seconds=elapsed)
+
+
+def make_encrypted_backup(command, target_backup, progress):
+    # Checkpoints stay unencrypted in backup folder for next incremental backups
+    command = command + ["--stream=xbstream", f"--extra-lsndir={target_backup}"]
+    cmd = f"{' '.join(shlex.quote(x) for x in command)} | {make_encryption_stage('encrypt')} " \
+          f"> {target_backup}/{ENCRYPTED_BACKUP_FILE_NAME}"
+    logging.debug("make_encrypted_backup - %s", target_backup)
+    f_name = __make_temp_bash()
+    code = execute_command_in_bash(command=cmd, f_name=f_name, progress=progress)
+    os.remove(f_name)
+    return code
+
+
+def is_backup_encrypted(backup_path):
+    return any(os.path.exists(f"{backup_path}/{x}/{ENCRYPTED_BACKUP_FILE_NAME}") for x in list_in_dir(backup_path))
+
+
+def extract_backup(source, target):
+    encrypted_file = f"{source}/{ENCRYPTED_BACKUP_FILE_NAME}"
+    if os.path.exists(encrypted_file) is False:
+        shutil.copytree(source, target)
+        return
+    os.makedirs(target)
+    logging.info("Decrypt backup %s to %s", source, target)
+    cmd = f"{make_encryption_stage('decrypt')} < {encrypted_file} | {STREAM_TOOL} -x -C {target}"
+    progress = Progress(stage=f"extract {source}", total=os.path.getsize(encrypted_file), target_dir=target)
+    f_name = __make_temp_bash()
+    code = execute_command_in_bash(command=cmd, f_name=f_name, progress=progress)
+    os.remove(f_name)
+    if code != 0:
+        raise Exception(f"Can't decrypt backup {encrypted_file}")
+    # Checkpoints are saved next to stream as well, buffer pool and schema files are saved only there
+    for x in os.listdir(source):
+        if x != ENCRYPTED_BACKUP_FILE_NAME and os.path.isfile(f"{source}/{x}") and \
+                os.path.exists(f"{target}/{x}") is False:
+            shutil.copy2(f"{source}/{x}", f"{target}/{x}")
+
+
+def extract_backup_chain(backup_path, backup_dir):
+    # Backup is extracted into empty folder in every restore mode, stored backup stays encrypted and intact
+    execute_command(["mkdir", "-p", RESTORE_CLONE_DIR])
+    clone_path = make_clone_path(backup_dir)
+    try:
+        for x in sorted(list_in_dir(backup_path)):
+            extract_backup(source=f"{backup_path}/{x}", target=f"{clone_path}/{x}")
+    except Exception:
+        execute_command(["rm", "-rf", clone_path])
+        raise
+    return clone_path
+
+
+def get_existing_path(path):
+    while os.path.exists(path) is False and path != os.path.dirname(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def get_free_space(path):
+    st = os.statvfs(get_existing_path(path))
+    return st.f_bavail * st.f_frsize
+
+
+def is_same_filesystem(first, second):
+    return os.stat(get_existing_path(first)).st_dev == os.stat(get_existing_path(second)).st_dev
+
+
+def check_free_space(path, size):
+    required = size * (100 + PREFLIGHT_FREE_SPACE_MARGIN) / 100
+    free = get_free_space(path)
+    logging.info("Preflight: %s needed on filesystem of %s, %s free", format_progress_value(required, "bytes"),
+                 path, format_progress_value(free, "bytes"))
+    if free >= required:
+        return True
+    if PREFLIGHT_ENFORCE is True:
+        logging.error("Not enough free space on filesystem of %s", path)
+        return False
+    logging.warning("Free space on filesystem of %s may be not enough", path)
+    return True
+
+
+def log_estimated_duration(operation, size):
+    throughput = get_throughput(operation)
+    if throughput > 0:
+        logging.info("Preflight: estimated %s duration - %s (%s/s in previous runs)", operation,
+                     timedelta(seconds=int(size / throughput)), format_progress_value(throughput, "bytes"))
+    else:
+        logging.info("Preflight: duration of %s is unknown, there are no previous runs", operation)
+
+
+def get_backup_source_size():
+    databases = get_profile_databases()
+    if len(databases) == 0:
+        return dir_size(MYSQL_DB_PATH) - sum(dir_size(os.path.join(MYSQL_DB_PATH, x))
+                                             for x in get_excluded_databases())
+    # System tablespace, undo and redo logs are copied with every partial backup
+    size = sum(os.path.getsize(os.path.join(MYSQL_DB_PATH, x)) for x in os.listdir(MYSQL_DB_PATH)
+               if os.path.isfile(os.path.join(MYSQL_DB_PATH, x)))
+    return size + sum(dir_size(os.path.join(MYSQL_DB_PATH, x)) for x in databases)
+
+
+def get_backup_size(source_backup, source_size):
+    if len(source_backup) == 0:
+        return source_size
+    # Changed pages can't be counted before backup, so incremental backup is expected as large as the largest
+    # of recent ones, size of source is the only upper bound
+    sizes = [x["bytes"] for x in read_history(get_backup_operation(source_backup))]
+    if len(sizes) == 0:
+        return source_size
+    logging.info("Preflight: largest of %s recent incremental backups - %s", len(sizes),
+                 format_progress_value(max(sizes), "bytes"))
+    return min(source_size, max(sizes))
+
+
+def get_backup_operation(source_backup):
+    return "incremental" if len(source_backup) > 0 else "backup"
+
+
+def preflight_backup(target_backup, source_backup, size):
+    logging.info("Preflight: estimated backup size - %s", format_progress_value(size, "bytes"))
+    log_estimated_duration(get_backup_operation(source_backup), size)
+    return check_free_space(target_backup, size)
+
+
+def get_clone_write_size(backup_path):
+    # Blocks of clone are shared with backup until prepare writes pages of incremental backups and redo log
+    size = sum(dir_size(f"{backup_path}/{x}") for x in get_inc_backup(backup_path))
+    for x in ("ib_logfile0", "xtrabackup_logfile"):
+        log_file = f"{backup_path}/{FULL_BACKUP_FOLDER_NAME}/{x}"
+        if os.path.exists(log_file):
+            size += os.path.getsize(log_file)
+    return size
+
+
+def get_restore_space(backup_path, imported):
+    # Space for clone and for datadir, restored clone is moved to datadir, tables of profiles are copied
+    size = dir_size(backup_path)
+    if is_backup_encrypted(backup_path):
+        moved = imported is False and is_same_filesystem(RESTORE_CLONE_DIR, os.path.dirname(MYSQL_DB_PATH))
+        return size, 0 if moved else size
+    method = get_clone_method(backup_path)
+    if method == "reflink":
+        return get_clone_write_size(backup_path), size if imported is True else 0
+    if method == "copy":
+        return size, size if imported is True else 0
+    return 0, size
+
+
+def preflight_restore(backup_dir, selected):
+    backup_path = make_backup_path(backup_dir)
+    size = dir_size(backup_path)
+    logging.info("Preflight: backup %s size - %s", backup_dir, format_progress_value(size, "bytes"))
+    log_estimated_duration("restore", size)
+    clone_size, datadir_size = get_restore_space(backup_path, imported=False)
+    for x in selected:
+        a, b = get_restore_space(x["backup_path"], imported=True)
+        clone_size += a
+        datadir_size += b
+    if is_same_filesystem(RESTORE_CLONE_DIR, os.path.dirname(MYSQL_DB_PATH)):
+        return check_free_space(MYSQL_DB_PATH, clone_size + datadir_size)
+    return (clone_size == 0 or check_free_space(RESTORE_CLONE_DIR, clone_size)) and \
+        check_free_space(MYSQL_DB_PATH, datadir_size)
 
 
 def make_backup(target_backup, source_backup=""):
+    size = get_backup_size(source_backup, get_backup_source_size())
+    if preflight_backup(target_backup, source_backup, size) is False:
+        logging.error("Backup %s is canceled by preflight check", target_backup)
+        return False
     execute_command(["mkdir", "-p", target_backup])
     command = make_backup_command(target_dir=target_backup, from_dir=source_backup)
-    execute_command(command)
+    # Progress is measured by written data, incremental backup writes changed pages only
+    progress = Progress(stage=f"{get_backup_operation(source_backup)} {target_backup}", total=size,
+                        target_dir=target_backup)
+    if ENCRYPTION is True:
+        code = make_encrypted_backup(command, target_backup=target_backup, progress=progress)
+    else:
+        code = execute_command(command, progress=progress)
+    if code != 0:
+        logging.error("Backup %s is failed", target_backup)
+        return False
+    if BUFFER_POOL_DUMP is True:
+        save_buffer_pool(target_backup)
+    if is_base_profile(BACKUP_PROFILE_NAME) is False:
+        save_profile_schema(target_backup)
+    return True
 
 
 def do_full_backup():
     logging.info("Do full backup")
-    make_backup(target_backup=FULL_BACKUP_PATH)
-    do_incremental_backup()
+    if make_backup(target_backup=FULL_BACKUP_PATH) is False:
+        return False
+    if get_profile_option("incremental", True) is True:
+        return do_incremental_backup()
+    return True
 
 
 def get_full_backup_path():
@@ -210,7 +942,7 @@ def get_full_backup_path():
 
 def do_inc_backup_from_backup(previous_backup: str, current_backup: str):
     logging.info("Starting incremental backup from %s to %s", previous_backup, current_backup)
-    make_backup(target_backup=current_backup, source_backup=previous_backup)
+    return make_backup(target_backup=current_backup, source_backup=previous_backup)
 
 
 def do_incremental_backup():
@@ -226,19 +958,25 @@ def do_incremental_backup():
     if full_backup_done is True and prev_inc_backup_done is True and cur_inc_backup_done is False:
         logging.debug("Full backup exists, previous incremental backup is exists. "
                       "Do incremental backup from incremental")
-        do_inc_backup_from_backup(previous_backup=INC_BACKUP_PATH_PREVIOUS, current_backup=INC_BACKUP_PATH_CURRENT)
+        return do_inc_backup_from_backup(previous_backup=INC_BACKUP_PATH_PREVIOUS,
+                                         current_backup=INC_BACKUP_PATH_CURRENT)
     elif full_backup_done is True and prev_inc_backup_done is False and cur_inc_backup_done is False:
         logging.debug("Full backup exists, incremental backup is not exists. Do incremental backup from full")
-        do_inc_backup_from_backup(previous_backup=FULL_BACKUP_PATH, current_backup=INC_BACKUP_PATH_CURRENT)
+        return do_inc_backup_from_backup(previous_backup=FULL_BACKUP_PATH, current_backup=INC_BACKUP_PATH_CURRENT)
     elif full_backup_done is True and prev_inc_backup_done is True and cur_inc_backup_done is True:
         logging.error("Incremental backup for today already exists. ")
     elif full_backup_done is True and prev_inc_backup_done is False and cur_inc_backup_done is True:
         logging.error("Incremental backup for today already exists. There are not any previous incremental backup")
     elif full_backup_done is False:
-        logging.debug("Full backup not exists. Do incremental backup from incremental")
-        do_full_backup()
+        # Full backup is made here without do_full_backup, it would come back here if full backup is failed
+        logging.debug("Full backup not exists. Do full backup and incremental backup from full")
+        if make_backup(target_backup=FULL_BACKUP_PATH) is False:
+            return False
+        return do_inc_backup_from_backup(previous_backup=FULL_BACKUP_PATH, current_backup=INC_BACKUP_PATH_CURRENT)
     else:
         logging.error("Something new...")
+        return False
+    return True
 
 
 def get_incremental_backup_path():
@@ -248,11 +986,12 @@ def get_incremental_backup_path():
 
 
 def get_previous_incremental_backup_path():
-    logging.debug("Today day - %s, Full backup - %s", TODAY_DAY_OF_WEEK, FULL_BACKUP_DAY)
+    logging.debug("Today day - %s, Full backup - %s", TODAY_DAY_OF_WEEK,
+                  get_profile_option("full_backup_day", FULL_BACKUP_DAY))
     logging.debug("Try to find previous incremental backup")
-    for x in range(FULL_BACKUP_DAY, TODAY_DAY_OF_WEEK):
+    for x in range(1, get_days_from_full_backup() + 1):
         prev_inc = get_today().date() - timedelta(days=int(x))
-        path = f"{WEEKLY_BACKUP_PATH}/inc_{prev_inc}"
+        path = f"{WEEKLY_BACKUP_PATH}/{INCREMENTAL_FOLDER_NAME_PREFIX}_{prev_inc}"
         logging.debug("get_previous_incremental_backup_path - %s", path)
         if is_backup_done(full=False, path=path) is True:
             return path
@@ -269,7 +1008,7 @@ def files_in_dir(search_path):
 
 def get_exists_backups():
     logging.debug("Get existed backups")
-    output = list_in_dir(search_path=BACKUP_BASE_DIR)
+    output = list_in_dir(search_path=get_backup_base_dir())
     logging.debug("Backup dirs found - %s", output)
     return sorted(output)
 
@@ -282,29 +1021,64 @@ def print_exists_backups(backups):
 
 def __read_stdin():
     _stdin: str = sys.stdin.readline()
+    if len(_stdin) == 0:
+        raise Exception("Can't read answer, stdin is closed. Set missed options in config file or command line")
     if _stdin[len(_stdin) - 1] == "\n":
         return _stdin[:-1]
     else:
         return _stdin
 
 
-def select_exists_backups(existed):
+def is_option_enabled(name):
+    return OPTIONS.get(name, "").lower() in YES_ANSWERS
+
+
+def get_option(name, prompt, default=None, validate=None, error=""):
+    value = OPTIONS.get(name, "")
+    if len(value) > 0:
+        if validate is None or validate(value):
+            return value
+        raise Exception(f"Wrong value of option \"{name}\" - {value}. {error}")
+    if is_option_enabled("no_input"):
+        if default is not None:
+            return default
+        raise Exception(f"Option \"{name}\" is required")
+    logging.info(prompt)
+    while True:
+        value = __read_stdin()
+        if len(value) == 0 and default is not None:
+            value = default
+        if (len(value) > 0 or default is not None) and (validate is None or validate(value)):
+            return value
+        logging.error(error)
+
+
+def confirm(prompt, name="yes"):
+    return get_option(name, prompt, default="no").lower() in YES_ANSWERS
+
+
+def select_exists_backups(existed, name="backup"):
     logging.debug("Select existed backups:")
 
-    a = __read_stdin()
-    while a not in existed:
-        logging.error("Backup \"%s\" not found in list", a)
-        print_exists_backups(existed)
-        a = __read_stdin()
+    def __validate(value):
+        return value in existed or (value == "latest" and len(existed) > 0)
+
+    a = get_option(name, "Enter name of backup (or \"latest\"):", validate=__validate,
+                   error="Backup not found in list, please try again!")
+    if a == "latest":
+        a = existed[-1]
+    logging.info("Selected backup - %s", a)
     return a
 
 
-def make_prepare_command(full_backup, apply_log_only, inc_backup=""):
+def make_prepare_command(full_backup, apply_log_only, inc_backup="", export=False):
     a = f"{BACKUP_TOOL} --prepare --target-dir={full_backup} "
     if len(inc_backup) > 0:
         a += f"--incremental-dir={inc_backup} "
     if apply_log_only is True:
         a += "--apply-log-only "
+    if export is True:
+        a += "--export "
     logging.debug("make_prepare_command.a - %s", a)
     t = str(a).split(" ")
     tt = []
@@ -319,10 +1093,27 @@ def prepare_full_backup(backup_path):
     full_backup = f"{backup_path}/{FULL_BACKUP_FOLDER_NAME}"
     a: str = make_prepare_command(full_backup=full_backup, apply_log_only=True)
     logging.debug("Command to prepare backup - %s", a)
-    execute_command(make_prepare_command(full_backup=full_backup, apply_log_only=True))
+    execute_command(make_prepare_command(full_backup=full_backup, apply_log_only=True),
+                    progress=make_prepare_progress(full_backup))
     return full_backup
 
 
+def make_prepare_progress(backup):
+    # Redo log copied during backup is applied from checkpoint LSN (to_lsn) up to last_lsn
+    checkpoints = read_checkpoints(backup)
+    to_lsn = int(checkpoints.get("to_lsn", 0))
+    last_lsn = int(checkpoints.get("last_lsn", to_lsn))
+    return Progress(stage=f"prepare {backup}", total=last_lsn - to_lsn, unit="lsn", parser=parse_backup_tool_line,
+                    offset=to_lsn)
+
+
+def get_command_option(command, option):
+    for x in command:
+        if x.startswith(f"{option}="):
+            return x[len(option) + 1:]
+    return ""
+
+
 def get_inc_backup(backup_path):
     r = list_in_dir(backup_path)
     incs = []
@@ -334,7 +1125,7 @@ def get_inc_backup(backup_path):
     return sorted(incs)
 
 
-def prepare_commands_for_incremental_backups(full_backup, backup_path):
+def prepare_commands_for_incremental_backups(full_backup, backup_path, export=False):
     logging.debug("Prepare incremental backups")
     inc_backups = get_inc_backup(backup_path)
     if len(inc_backups) > 0:
@@ -350,48 +1141,231 @@ def prepare_commands_for_incremental_backups(full_backup, backup_path):
         inc_backup_last = inc_backups[-1]
         inc_backup = f"{backup_path}/{inc_backup_last}"
         logging.debug("inc_backup_last - %s\ninc_backup - %s", inc_backup_last, inc_backup)
-        commands.append(make_prepare_command(full_backup=full_backup, inc_backup=inc_backup, apply_log_only=False))
+        commands.append(make_prepare_command(full_backup=full_backup, inc_backup=inc_backup, apply_log_only=False,
+                                             export=export))
         logging.debug("List of commands - %s", commands)
         return commands, inc_backup
     else:
-        logging.error("There are not found incremental backups in folder %s", backup_path)
-        return []
+        logging.warning("There are not found incremental backups in folder %s", backup_path)
+        return [make_prepare_command(full_backup=full_backup, apply_log_only=False, export=export)], ""
 
 
 def make_backup_path(backup_dir):
-    return f"{BACKUP_BASE_DIR}/{backup_dir}"
+    return f"{get_backup_base_dir()}/{backup_dir}"
 
 
 def execute_prepare_commands(cmds):
     if len(cmds) > 0:
         for x in cmds:
             logging.debug("Execute command - %s", x)
-            execute_command(x)
+            backup = get_command_option(x, "--incremental-dir") or get_command_option(x, "--target-dir")
+            execute_command(x, progress=make_prepare_progress(backup))
 
 
-def prepare_backup(prev_step: bool):
+def select_backup_to_restore():
+    backup_list = get_exists_backups()
+    print_exists_backups(backup_list)
+    return select_exists_backups(backup_list, name=get_backup_option_name())
+
+
+def get_backup_option_name():
+    if len(BACKUP_PROFILE_NAME) == 0:
+        return "backup"
+    return f"backup_{BACKUP_PROFILE_NAME}"
+
+
+def prepare_backup(prev_step: bool, backup_dir):
     if prev_step is False:
-        return False, ""
+        return False, "", "", ""
     if os.path.exists(MYSQL_DB_PATH) is False:
-        backup_list = get_exists_backups()
-        print_exists_backups(backup_list)
-        backup_dir = select_exists_backups(backup_list)
-        logging.info("Are you sure you want to restore this backup? [Y(yes) or N(no)]: ")
-
-        if __read_stdin().lower() in ("y", "yes"):
-            backup_path = make_backup_path(backup_dir)
-            full_backup = prepare_full_backup(backup_path)
-            prepare_cmds, last_inc_backup = prepare_commands_for_incremental_backups(full_backup=full_backup,
-                                                                                     backup_path=backup_path)
-            execute_prepare_commands(cmds=prepare_cmds)
-            return True, full_backup, last_inc_backup, backup_path
-        else:
-            return False, "", "", ""
+        full_backup, last_inc_backup, backup_path = prepare_backup_chain(backup_dir)
+        return True, full_backup, last_inc_backup, backup_path
     else:
         logging.error("Previous instance is exists, remove it before prepare restoration")
         return False, "", "", ""
 
 
+def prepare_backup_chain(backup_dir, export=False):
+    backup_path = make_backup_path(backup_dir)
+    method = "extract" if is_backup_encrypted(backup_path) else get_clone_method(backup_path)
+    if method == "extract":
+        backup_path = extract_backup_chain(backup_path=backup_path, backup_dir=backup_dir)
+    elif len(method) > 0:
+        backup_path = clone_backup(backup_path=backup_path, backup_dir=backup_dir, method=method)
+    full_backup = prepare_full_backup(backup_path)
+    prepare_cmds, last_inc_backup = prepare_commands_for_incremental_backups(full_backup=full_backup,
+                                                                             backup_path=backup_path,
+                                                                             export=export)
+    execute_prepare_commands(cmds=prepare_cmds)
+    return full_backup, last_inc_backup, backup_path
+
+
+def select_profile_backups():
+    selected = []
+    for name in get_backup_profile_names():
+        if name == get_base_profile_name():
+            continue
+        use_backup_profile(name)
+        backup_list = get_exists_backups()
+        print_exists_backups(backup_list)
+        backup_dir = select_exists_backups(backup_list, name=get_backup_option_name())
+        selected.append({"name": name, "backup_dir": backup_dir, "backup_path": make_backup_path(backup_dir)})
+    use_backup_profile(get_base_profile_name())
+    return selected
+
+
+def prepare_profile_backups(selected):
+    prepared = []
+    for x in selected:
+        use_backup_profile(x["name"])
+        # Tables of profile are imported as transportable tablespaces, so backup is prepared with --export
+        full_backup, last_inc_backup, backup_path = prepare_backup_chain(x["backup_dir"], export=True)
+        prepared.append({"name": x["name"], "full_backup": full_backup, "last_inc_backup": last_inc_backup,
+                         "backup_path": backup_path})
+    use_backup_profile(get_base_profile_name())
+    return prepared
+
+
+def import_table_files(db_name, table, full_backup):
+    for ext in (".ibd", ".cfg"):
+        source = f"{full_backup}/{db_name}/{table}{ext}"
+        target = f"{MYSQL_DB_PATH}/{db_name}/{table}{ext}"
+        if os.path.exists(source):
+            shutil.copy2(source, target)
+            shutil.chown(target, "mysql", "mysql")
+
+
+def import_profile_backup(backup, password):
+    logging.info("Import backup of profile \"%s\" from %s", backup["name"], backup["full_backup"])
+    schema_file = ""
+    for x in (backup["last_inc_backup"], backup["full_backup"]):
+        for suffix in ("", ENCRYPTED_FILE_SUFFIX):
+            if len(schema_file) == 0 and len(x) > 0 and os.path.exists(f"{x}/{PROFILE_SCHEMA_FILE_NAME}{suffix}"):
+                schema_file = f"{x}/{PROFILE_SCHEMA_FILE_NAME}{suffix}"
+    if schema_file.endswith(ENCRYPTED_FILE_SUFFIX):
+        cmd = f"{make_encryption_stage('decrypt')} < {schema_file} | {make_mysql_command(password=password)}"
+    else:
+        cmd = f"{make_mysql_command(password=password)} < {schema_file}"
+    logging.debug("import_profile_backup.schema - %s", schema_file)
+    # Databases restored with base backup are dropped, tables created after profile backup should not stay
+    for db_name in BACKUP_PROFILES[backup["name"]].get("databases", []):
+        execute_query(f"DROP DATABASE IF EXISTS `{db_name}`", password=password)
+    f_name = __make_temp_bash()
+    if execute_command_in_bash(command=cmd, f_name=f_name) != 0:
+        logging.error("Can't create databases of profile \"%s\" from %s", backup["name"], schema_file)
+    os.remove(f_name)
+
+    for db_name in BACKUP_PROFILES[backup["name"]].get("databases", []):
+        for f in sorted(os.listdir(f"{backup['full_backup']}/{db_name}")):
+            table, ext = os.path.splitext(f)
+            if ext in (".MYD", ".MAD"):
+                logging.warning("Table %s.%s is not InnoDB table, it is not imported", db_name, table)
+            if ext != ".ibd":
+                continue
+            logging.debug("import_profile_backup.table - %s.%s", db_name, table)
+            sql = f"SET SESSION foreign_key_checks = 0; ALTER TABLE `{db_name}`.`{table}`"
+            if execute_query(f"{sql} DISCARD TABLESPACE", password=password) is None:
+                continue
+            import_table_files(db_name=db_name, table=table, full_backup=backup["full_backup"])
+            execute_query(f"{sql} IMPORT TABLESPACE", password=password)
+    logging.warning("Databases of profile \"%s\" are restored to time of their own backup", backup["name"])
+
+
+def remove_restored_backup(backup_path):
+    if len(backup_path) == 0:
+        return
+    if is_backup_clone(backup_path):
+        remove_backup_clone(backup_path)
+    else:
+        rename_restored_backup(backup_path)
+
+
+def make_backup_after_restore():
+    for name in get_backup_profile_names():
+        use_backup_profile(name)
+        # Restored backup is intact if it was cloned, move aside current weekly backup to make new chain
+        if os.path.exists(WEEKLY_BACKUP_PATH):
+            rename_restored_backup(WEEKLY_BACKUP_PATH)
+        if do_full_backup() is False:
+            logging.error("Backup after restore of profile \"%s\" is failed, make it manually", name)
+
+
+def make_clone_path(backup_dir):
+    return f"{RESTORE_CLONE_DIR}/{backup_dir}_{generate_random_string()}"
+
+
+def is_backup_clone(backup_path):
+    return os.path.dirname(backup_path) == RESTORE_CLONE_DIR
+
+
+def is_reflink_supported(backup_path):
+    execute_command(["mkdir", "-p", RESTORE_CLONE_DIR])
+    probe = f"{os.path.dirname(backup_path)}/.reflink_{generate_random_string()}"
+    target = f"{RESTORE_CLONE_DIR}/{os.path.basename(probe)}"
+    save_to_file(file_path=probe, text="reflink")
+    res = execute_command(["cp", "--reflink=always", probe, target]) == 0
+    for x in (probe, target):
+        if os.path.exists(x):
+            os.remove(x)
+    logging.debug("is_reflink_supported - %s", res)
+    return res
+
+
+def get_clone_method(backup_path):
+    if RESTORE_MODE != "clone":
+        return ""
+    # Clone is moved to datadir with rename, on other filesystem it would be copied twice
+    if is_same_filesystem(RESTORE_CLONE_DIR, os.path.dirname(MYSQL_DB_PATH)) is False:
+        logging.warning("Folder %s is not on filesystem of %s, backup is restored in place", RESTORE_CLONE_DIR,
+                        MYSQL_DB_PATH)
+        return ""
+    if is_reflink_supported(backup_path) is False:
+        logging.warning("Copy-on-write clone is not available for %s, backup is copied", backup_path)
+        return "copy"
+    return "reflink"
+
+
+def copy_file(paths):
+    source, target = paths
+    shutil.copy2(source, target)
+
+
+def clone_backup_parallel(source, target):
+    logging.debug("clone_backup_parallel - %s -> %s, threads - %s", source, target, PARALLEL_THREAD_NUM)
+    files = []
+    for root, _, names in os.walk(source):
+        target_root = os.path.join(target, os.path.relpath(root, source))
+        os.makedirs(target_root, exist_ok=True)
+        shutil.copystat(root, target_root)
+        for name in names:
+            files.append((os.path.join(root, name), os.path.join(target_root, name)))
+    with ThreadPool(max(1, PARALLEL_THREAD_NUM)) as pool:
+        pool.map(copy_file, files)
+
+
+def clone_backup(backup_path, backup_dir, method):
+    clone_path = make_clone_path(backup_dir)
+    logging.info("Clone backup %s to %s (%s)", backup_path, clone_path, method)
+    try:
+        if method == "copy":
+            clone_backup_parallel(source=backup_path, target=clone_path)
+        elif execute_command(["cp", "-a", "--reflink=always", backup_path, clone_path]) != 0:
+            raise Exception(f"Can't clone backup {backup_path} to {clone_path}")
+    except Exception:
+        execute_command(["rm", "-rf", clone_path])
+        raise
+    return clone_path
+
+
+def remove_backup_clone(clone_path):
+    if is_backup_clone(clone_path) is False:
+        logging.error("Path %s is not a clone of backup, skip removing", clone_path)
+        return
+    cmd = f"rm -rf {clone_path}"
+    logging.debug("remove_backup_clone - %s", cmd)
+    execute_command(cmd.split(" "))
+
+
 def mysql_stop():
     cmd = "systemctl stop mysql"
     logging.debug("Stopping MySQL - %s", cmd)
@@ -431,9 +1405,14 @@ def restore_db(prev_step, full_backup):
     if prev_step is False:
         return False
     if os.path.exists(full_backup):
-        cmd = f"{BACKUP_TOOL} --copy-back --target-dir={full_backup} --datadir={MYSQL_DB_PATH}"
+        # Prepared clone is not needed after restoration, so files are moved instead of copied
+        moved = is_backup_clone(os.path.dirname(full_backup)) and \
+            is_same_filesystem(RESTORE_CLONE_DIR, os.path.dirname(MYSQL_DB_PATH))
+        mode = "--move-back" if moved else "--copy-back"
+        cmd = f"{BACKUP_TOOL} {mode} --target-dir={full_backup} --datadir={MYSQL_DB_PATH}"
         logging.debug("Execute command - %s", cmd)
-        execute_command(cmd.split(" "))
+        progress = Progress(stage=f"restore {full_backup}", total=dir_size(full_backup), target_dir=MYSQL_DB_PATH)
+        execute_command(cmd.split(" "), progress=progress)
         return True
 
 
@@ -458,19 +1437,131 @@ def restore_folder_permissions(prev_step):
     return True
 
 
-def execute_command_in_bash(command):
-    f_name = __make_temp_bash()
-    save_to_file(file_path=f_name, text=command)
-    execute_command(f"/usr/bin/bash {f_name}".split(" "))
-    return f_name
+def execute_command_in_bash(command, f_name, progress=None, check=False):
+    save_to_file(file_path=f_name, text=f"set -o pipefail\n{command}")
+    code = execute_command(f"/usr/bin/bash {f_name}".split(" "), progress=progress)
+    if check is True and code != 0:
+        raise Exception(f"Command from {f_name} is failed with code {code}")
+    return code
+
+
+def make_mysql_command(password, user="", host="", port="", db_name=""):
+    cmd = f"/usr/bin/mysql --user={user if len(user) > 0 else MYSQL_USER} " \
+          f"--host={host if len(host) > 0 else MYSQL_HOST} --port={port if len(port) > 0 else MYSQL_PORT} " \
+          f"--password={password}"
+    return f"{cmd} {db_name}" if len(db_name) > 0 else cmd
+
+
+def execute_query(query, password, user="", host="", port=""):
+    user = user if len(user) > 0 else MYSQL_USER
+    host = host if len(host) > 0 else MYSQL_HOST
+    port = port if len(port) > 0 else MYSQL_PORT
+    cmd = ["/usr/bin/mysql", f"--user={user}", f"--host={host}", f"--port={port}", f"--password={password}",
+           "--batch", "--skip-column-names", f"--execute={query}"]
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+    if res.returncode != 0:
+        logging.error("Can't execute query - %s", query)
+        return None
+    return [x.split("\t") for x in res.stdout.splitlines()]
+
+
+def get_table_rows(db_name, db_pass):
+    rows = execute_query(f"SELECT table_name, IFNULL(table_rows, 0) FROM information_schema.tables "
+                         f"WHERE table_schema = '{db_name}'", password=db_pass)
+    return {x[0]: int(x[1]) for x in rows or [] if len(x) == 2}
+
+
+BUFFER_POOL_PAGES_RE = re.compile(r"Loaded (\d+)/(\d+) pages")
+
+
+def get_buffer_pool_status(variable, password, user=""):
+    rows = execute_query(f"SHOW GLOBAL STATUS LIKE '{variable}'", password=password, user=user)
+    if rows is None or len(rows) == 0:
+        return None
+    return rows[0][-1]
 
 
-def apply_bin_log(password):
-    cmd = f"/usr/bin/mysql --user={MYSQL_USER} --host={MYSQL_HOST} --port={MYSQL_PORT} --password={password} " \
-          f"< {BIN_LOG_IN_SQL}"
-    logging.debug("apply_bin_log - %s", cmd)
-    global APPLY_BIN_LOG_FILE
-    APPLY_BIN_LOG_FILE = execute_command_in_bash(command=cmd)
+def wait_buffer_pool_status(variable, password, user="", previous=""):
+    progress = None
+    started = time.time()
+    while time.time() - started < BUFFER_POOL_TIMEOUT:
+        status = get_buffer_pool_status(variable=variable, password=password, user=user)
+        if status is None:
+            return False
+        m = BUFFER_POOL_PAGES_RE.search(status)
+        if m is not None:
+            if progress is None:
+                progress = Progress(stage="buffer pool load", total=int(m.group(2)), unit="pages")
+            progress.update(int(m.group(1)))
+        elif status != previous and "completed" in status:
+            logging.info("%s - %s", variable, status)
+            if progress is not None:
+                progress.finish(0)
+            return True
+        elif any(x in status.lower() for x in ("abort", "error", "cannot")):
+            logging.error("%s - %s", variable, status)
+            return False
+        time.sleep(1)
+    logging.warning("%s is not completed in %s seconds", variable, BUFFER_POOL_TIMEOUT)
+    return False
+
+
+def save_buffer_pool(target_backup):
+    password = read_password_from_file()
+    rows = execute_query("SELECT @@datadir, @@innodb_buffer_pool_filename", password=password, user=BACKUP_USER)
+    if rows is None or len(rows) == 0:
+        logging.warning("Can't find InnoDB buffer pool dump file, skip it")
+        return False
+    buffer_pool_file = os.path.join(rows[0][0], rows[0][1])
+    previous = get_buffer_pool_status("Innodb_buffer_pool_dump_status", password=password, user=BACKUP_USER)
+    logging.debug("save_buffer_pool - %s", buffer_pool_file)
+    if execute_query("SET GLOBAL innodb_buffer_pool_dump_now = ON", password=password, user=BACKUP_USER) is None:
+        return False
+    if wait_buffer_pool_status("Innodb_buffer_pool_dump_status", password=password, user=BACKUP_USER,
+                               previous=previous or "") is False:
+        return False
+    try:
+        shutil.copy2(buffer_pool_file, f"{target_backup}/{BUFFER_POOL_FILE_NAME}")
+    except OSError as e:
+        logging.warning("Can't save InnoDB buffer pool dump %s - %s", buffer_pool_file, e)
+        return False
+    return True
+
+
+def restore_buffer_pool(prev_step, full_backup, last_inc_backup):
+    if prev_step is False:
+        return False
+    # Last backup of the chain has the most recent page list
+    for x in (last_inc_backup, full_backup):
+        buffer_pool_file = f"{x}/{BUFFER_POOL_FILE_NAME}"
+        if len(x) > 0 and os.path.exists(buffer_pool_file):
+            logging.debug("restore_buffer_pool - %s", buffer_pool_file)
+            shutil.copy2(buffer_pool_file, f"{MYSQL_DB_PATH}/{BUFFER_POOL_FILE_NAME}")
+            return True
+    logging.warning("InnoDB buffer pool dump not found in backup, buffer pool will be cold")
+    return True
+
+
+def load_buffer_pool(password):
+    rows = execute_query("SELECT @@innodb_buffer_pool_load_at_startup", password=password)
+    if rows is None:
+        return False
+    if len(rows) > 0 and rows[0][0] == "0":
+        logging.info("Load InnoDB buffer pool")
+        if execute_query("SET GLOBAL innodb_buffer_pool_load_now = ON", password=password) is None:
+            return False
+    return True
+
+
+def wait_buffer_pool_load(password):
+    return wait_buffer_pool_status("Innodb_buffer_pool_load_status", password=password)
+
+
+def start_bin_log_applier(password):
+    cmd = ["/usr/bin/mysql", f"--user={MYSQL_USER}", f"--host={MYSQL_HOST}", f"--port={MYSQL_PORT}",
+           f"--password={password}"]
+    logging.debug("start_bin_log_applier - %s@%s:%s", MYSQL_USER, MYSQL_HOST, MYSQL_PORT)
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
 
 
 def rename_restored_backup(backup_dir):
@@ -482,10 +1573,13 @@ def rename_restored_backup(backup_dir):
 
 
 def purge_binary_logs(password):
-    cmd = f"/usr/bin/mysql --user={MYSQL_USER} --host={MYSQL_HOST} --port={MYSQL_PORT} --password={password} " \
-          f"--execute='PURGE BINARY LOGS BEFORE NOW();'"
+    cmd = f"{make_mysql_command(password=password)} --execute='PURGE BINARY LOGS BEFORE NOW();'"
     global PURGE_BINARY_LOGS_FILE
-    PURGE_BINARY_LOGS_FILE = execute_command_in_bash(command=cmd)
+    PURGE_BINARY_LOGS_FILE = __make_temp_bash()
+    execute_command_in_bash(command=cmd, f_name=PURGE_BINARY_LOGS_FILE)
+
+
+BINLOG_MAGIC = b"\xfebin"
 
 
 def make_binlog_info_file_path(path):
@@ -527,19 +1621,118 @@ def get_bin_files(mysqlbin_file):
     return path_bin_files
 
 
-def convert_bin_files_to_sql(bin_files, lsn, damage_time):
-    def __bin_file_to_line():
-        return " ".join(x for x in bin_files)
+def read_bin_file_start_time(bin_file):
+    # Timestamp of first event (format description) follows 4 bytes of magic number in header of binary log
+    with open(bin_file, "rb") as f:
+        header = f.read(8)
+    if len(header) < 8 or header[:4] != BINLOG_MAGIC:
+        logging.warning("Can't read start time of MySQL binary log %s", bin_file)
+        return None
+    return datetime.fromtimestamp(int.from_bytes(header[4:8], "little"))
 
-    if len(damage_time) == 0:
-        cmd = f"mysqlbinlog --start-position={lsn} {__bin_file_to_line()}"
-    else:
-        cmd = f"mysqlbinlog --start-position={lsn}  --stop-datetime={damage_time} {__bin_file_to_line()}"
-    cmd += f" > {BIN_LOG_IN_SQL}"
 
-    logging.debug("convert_bin_files_to_sql - %s", cmd)
-    global CONVERTED_BINFILES_SQL
-    CONVERTED_BINFILES_SQL = execute_command_in_bash(command=cmd)
+def select_bin_files_to_decode(bin_files, damage_time):
+    if len(damage_time) == 0:
+        return bin_files
+    stop_time = datetime.strptime(damage_time, "%Y-%m-%dT%H:%M:%S")
+    res = []
+    for i, x in enumerate(bin_files):
+        # Modification time is changed by copy of binary logs, so files are selected by time of first event
+        start_time = read_bin_file_start_time(x) if i > 0 else None
+        if start_time is not None and start_time > stop_time:
+            break
+        res.append(x)
+    logging.debug("select_bin_files_to_decode - %s", res)
+    return res
+
+
+def make_binlog_decode_command(bin_file, result_file, lsn="", damage_time="", database=""):
+    cmd = ["mysqlbinlog"]
+    if len(lsn) > 0:
+        cmd.append(f"--start-position={lsn}")
+    if len(damage_time) > 0:
+        cmd.append(f"--stop-datetime={damage_time}")
+    if len(database) > 0:
+        cmd.append(f"--database={database}")
+    cmd.append(f"--result-file={result_file}")
+    cmd.append(bin_file)
+    return cmd
+
+
+def decode_bin_file(command):
+    logging.debug("decode_bin_file - %s", command)
+    return execute_command(command)
+
+
+def append_decoded_bin_file(output, part_file, result, done):
+    code = result.get()
+    if done is True and code != 0:
+        logging.error("Can't decode MySQL binary log, see %s", part_file)
+        return False
+    if done is True:
+        try:
+            with open(part_file, "rb") as f:
+                shutil.copyfileobj(f, output)
+            output.flush()
+        except OSError as e:
+            logging.error("MySQL client stopped applying binary logs - %s", e)
+            done = False
+    # Parts after failed one are skipped, events of binary logs can't be applied with a gap
+    os.remove(part_file)
+    return done
+
+
+def convert_bin_files_to_sql(bin_files, lsn, damage_time, part_prefix, output, database=""):
+    bin_files = select_bin_files_to_decode(bin_files=bin_files, damage_time=damage_time)
+    commands = []
+    # Every file is decoded up to damage time, events after it can be in any selected file
+    for i, x in enumerate(bin_files):
+        commands.append((f"{part_prefix}.{i:06d}",
+                         make_binlog_decode_command(bin_file=x, result_file=f"{part_prefix}.{i:06d}",
+                                                    lsn=lsn if i == 0 else "", damage_time=damage_time,
+                                                    database=database)))
+    threads = max(1, BINLOG_DECODE_THREAD_NUM)
+    logging.info("Decode %s MySQL binary logs with %s threads", len(commands), threads)
+
+    started = time.time()
+    done = True
+    # Decoded parts are fed to applier in binary log order while next parts are decoded,
+    # number of parts on disk is limited by window size
+    pending = deque()
+    with ThreadPool(threads) as pool:
+        for part_file, cmd in commands:
+            pending.append((part_file, pool.apply_async(decode_bin_file, (cmd,))))
+            if len(pending) >= 2 * threads:
+                done = append_decoded_bin_file(output, *pending.popleft(), done=done)
+        while len(pending) > 0:
+            done = append_decoded_bin_file(output, *pending.popleft(), done=done)
+
+    elapsed = max(time.time() - started, 0.001)
+    size = sum(os.path.getsize(x) for x in bin_files)
+    logging.info("Decoded and applied %s MB of MySQL binary logs in %.1f sec (%.1f MB/s)",
+                 round(size / 1024 / 1024, 1), elapsed, size / 1024 / 1024 / elapsed)
+    return done
+
+
+def replay_bin_logs(password, full_backup, last_inc_backup, damage_time, database=""):
+    binlog_info = get_binlog_info_file(last_inc_backup=last_inc_backup, full_backup=full_backup)
+    logging.debug("binlog_info - %s", binlog_info)
+    mysqlbin_file, lsn, _ = __read_file(binlog_info)
+    logging.debug("mysqlbin_file - %s, lsn - %s", mysqlbin_file, lsn)
+    bin_files = get_bin_files(mysqlbin_file)
+    part_prefix = BIN_LOG_IN_SQL if len(database) == 0 else f"{BIN_LOG_IN_SQL}.{database}"
+    applier = start_bin_log_applier(password=password)
+    done = convert_bin_files_to_sql(bin_files=bin_files, lsn=lsn, damage_time=damage_time, part_prefix=part_prefix,
+                                    output=applier.stdin, database=database)
+    try:
+        applier.stdin.close()
+    except OSError:
+        pass
+    code = applier.wait()
+    if done is False:
+        logging.error("MySQL binary logs are applied only up to first failed part")
+    elif code != 0:
+        logging.error("MySQL client failed to apply binary logs, code %s", code)
 
 
 def save_to_file(file_path, text):
@@ -552,139 +1745,158 @@ def __make_temp_bash():
 
 
 def restore_databases():
+    # Backups are selected, checked and confirmed before any of them is prepared and current instance is stopped
+    selected = select_profile_backups() if len(BACKUP_PROFILES) > 0 else []
+    backup_dir = select_backup_to_restore()
+    # Missed options fail restoration here with --no_input, not after current instance is replaced
+    password = read_password_from_stdin()
+    apply_binlog = confirm("Do you want apply MySQL binary logs? [Y(yes) or N(no)]: ", name="apply_binlog")
+    damage_time = get_damage_time() if apply_binlog is True else ""
+    if preflight_restore(backup_dir, selected) is False or \
+            confirm("Are you sure you want to restore this backup? [Y(yes) or N(no)]: ") is False:
+        logging.error("Restoration is canceled")
+        return
+    imports = prepare_profile_backups(selected)
     remove_exists_instance()
-    prev_step, full_backup, last_inc_backup, backup_dir = prepare_backup(True)
+    prev_step, full_backup, last_inc_backup, backup_dir = prepare_backup(True, backup_dir)
     prev_step = restore_db(prev_step, full_backup)
+    if BUFFER_POOL_DUMP is True:
+        prev_step = restore_buffer_pool(prev_step, full_backup, last_inc_backup)
     prev_step = restore_folder_permissions(prev_step)
     prev_step = mysql_start(prev_step)
 
-    password = ""
+    # Buffer pool is loaded in background, imports and binary logs are applied without waiting for it
+    buffer_pool_loading = prev_step is True and BUFFER_POOL_DUMP is True and load_buffer_pool(password=password)
     if prev_step is True:
-        logging.info("Do you want apply MySQL binary logs? [Y(yes) or N(no)]: ")
-
-        if __read_stdin().lower() in ("y", "yes"):
-            password = read_password_from_stdin()
-            logging.info("Enter time when you database was damaged (in format like 2018-07-15T19:27:00)")
-            damage_time = __read_stdin()
-            binlog_info = get_binlog_info_file(last_inc_backup=last_inc_backup, full_backup=full_backup)
-            logging.debug("binlog_info - %s", binlog_info)
-            mysqlbin_file, lsn, _ = __read_file(binlog_info)
-            logging.debug("mysqlbin_file - %s, lsn - %s", mysqlbin_file, lsn)
-            bin_files = get_bin_files(mysqlbin_file)
-            convert_bin_files_to_sql(bin_files=bin_files, lsn=lsn, damage_time=damage_time)
-            apply_bin_log(password=password)
-    rename_restored_backup(backup_dir)
-    do_full_backup()
+        if apply_binlog is True:
+            replay_bin_logs(password=password, full_backup=full_backup, last_inc_backup=last_inc_backup,
+                            damage_time=damage_time)
+        # Databases of profiles are replaced after replay of whole instance and every database is replayed
+        # from position of its own backup (statements with other default database are skipped by mysqlbinlog)
+        for x in imports:
+            import_profile_backup(x, password=password)
+            if apply_binlog is True:
+                for db_name in BACKUP_PROFILES[x["name"]].get("databases", []):
+                    replay_bin_logs(password=password, full_backup=x["full_backup"],
+                                    last_inc_backup=x["last_inc_backup"], damage_time=damage_time,
+                                    database=db_name)
+    if buffer_pool_loading is True:
+        wait_buffer_pool_load(password=password)
+    remove_restored_backup(backup_dir)
+    for x in imports:
+        remove_restored_backup(x["backup_path"])
+    make_backup_after_restore()
     purge_binary_logs(password=password)
 
 
 def read_password_from_stdin():
-    logging.info("Enter password for user %s@%s:%s", MYSQL_USER, MYSQL_HOST, MYSQL_PORT)
-    return __read_stdin()
+    if len(OPTIONS.get("password_file", "")) > 0:
+        return read_password_from_file(OPTIONS["password_file"])
+    return get_option("password", f"Enter password for user {MYSQL_USER}@{MYSQL_HOST}:{MYSQL_PORT}",
+                      error="Password can not be empty. Please, try again!")
+
+
+def is_valid_damage_time(value):
+    try:
+        datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
+        return True
+    except ValueError:
+        return len(value) == 0
+
+
+def get_damage_time():
+    return get_option("damage_time", "Enter time when you database was damaged (in format like 2018-07-15T19:27:00)",
+                      default="", validate=is_valid_damage_time,
+                      error="Time should be in format like 2018-07-15T19:27:00. Please, try again!")
 
 
 def get_source_db_name():
-    logging.info("Enter name of source DB:")
-    name = __read_stdin()
-    if len(name) != 0:
-        return name
-    else:
-        logging.error("Database name can not be empty. Please, try again!")
-        get_source_db_name()
+    return get_option("source_db", "Enter name of source DB:",
+                      error="Database name can not be empty. Please, try again!")
 
 
 def get_target_db_host():
-    logging.info("Enter database host to import dump to database (if empty will use host \"127.0.0.1\", "
-                 "ie \"localhost\"):")
-    val = __read_stdin()
-    if len(val) == 0:
-        return "127.0.0.1"
-    else:
-        return val
+    return get_option("db_host", "Enter database host to import dump to database (if empty will use host "
+                                 "\"127.0.0.1\", ie \"localhost\"):", default="127.0.0.1")
 
 
 def get_target_db_port():
-    logging.info("Enter database port to import dump to database (if empty will use port \"3306\"):")
-    val = __read_stdin()
-    if len(val) == 0:
-        return "3306"
-    else:
-        return val
+    return get_option("db_port", "Enter database port to import dump to database (if empty will use port \"3306\"):",
+                      default="3306")
 
 
 def get_target_db_user():
-    logging.info("Enter database user to import dump to database (if empty will use user \"root\"):")
-    val = __read_stdin()
-    if len(val) == 0:
-        return "root"
-    else:
-        return val
+    return get_option("db_user", "Enter database user to import dump to database (if empty will use user \"root\"):",
+                      default="root")
 
 
 def get_target_db_pass():
-    logging.info("Enter user's password to import dump to database:")
-    val = __read_stdin()
-    if len(val) != 0:
-        return val
-    else:
-        logging.error("User's password can not be empty. Please, try again!")
-        get_target_db_pass()
+    return get_option("db_pass", "Enter user's password to import dump to database:",
+                      error="User's password can not be empty. Please, try again!")
 
 
 def get_target_db_name():
-    logging.info("Enter name of target DB:")
-    val = __read_stdin()
-    if len(val) != 0:
-        return val
-    else:
-        logging.error("Database name can not be empty. Please, try again!")
-        get_target_db_name()
+    return get_option("target_db", "Enter name of target DB:",
+                      error="Database name can not be empty. Please, try again!")
 
 
 def get_target_db_key():
-    logging.info("Enter current database key (16 characters length):")
-    val = __read_stdin()
-    if len(val) == 16:
-        return val
-    else:
-        logging.error("Key length should be equal 16 characters. Please, try again!")
-        get_target_db_key()
+    return get_option("db_key", "Enter current database key (16 characters length):",
+                      validate=lambda x: len(x) == 16,
+                      error="Key length should be equal 16 characters. Please, try again!")
 
 
 def get_export_folder():
-    logging.info("Enter dump folder name:")
-    destination_folder = __read_stdin()
-    logging.debug("destination folder - %s", destination_folder)
-    if os.path.isdir(destination_folder) and os.path.exists(destination_folder):
-        if destination_folder is not None:
-            return destination_folder
-    else:
-        logging.error("Folder name is empty or folder does not exists!")
-        get_export_folder()
+    return get_option("export_folder", "Enter dump folder name:", validate=os.path.isdir,
+                      error="Folder name is empty or folder does not exists!")
 
 
-def export_db(db_name, db_pass, destination_folder=""):
+def export_db(db_name, db_pass, destination_folder="", check=False):
     if len(destination_folder) == 0:
         destination_folder = "/tmp"
 
     dump_file = f"{destination_folder}/{db_name}_{datetime_in_custom_format()}.sql.gz"
+    if ENCRYPTION is True:
+        read_encryption_key()
+        dump_file += ENCRYPTED_FILE_SUFFIX
+        compress = f"gzip | {make_encryption_stage('encrypt')}"
+    else:
+        compress = "gzip"
     cmd = f"/usr/bin/mysqldump --user={MYSQL_USER} --host={MYSQL_HOST} --port={MYSQL_PORT} " \
-          f"--password={db_pass} --lock-tables=false " \
-          f"--events --routines --triggers {db_name} | gzip > {dump_file}"
+          f"--password={db_pass} --lock-tables=false --verbose " \
+          f"--events --routines --triggers {db_name} | {compress} > {dump_file}"
     logging.debug("export_db.cmd - %s", cmd)
-    return dump_file, execute_command_in_bash(command=cmd)
+    # Row counts of InnoDB tables in information_schema are estimations, so progress is approximate
+    table_rows = get_table_rows(db_name=db_name, db_pass=db_pass)
+    progress = Progress(stage=f"export {db_name}", total=sum(table_rows.values()), unit="rows",
+                        parser=parse_mysqldump_line, sizes=table_rows)
+    f_name = __make_temp_bash()
+    execute_command_in_bash(command=cmd, f_name=f_name, progress=progress, check=check)
+    return dump_file, f_name
 
 
-def import_db(db_name, db_pass, dump_file, db_host="", db_port="", db_user=""):
+def import_db(db_name, db_pass, dump_file, db_host="", db_port="", db_user="", check=False):
     if len(db_host) == 0 and len(db_port) == 0 and len(db_user) <= 0:
         db_host = MYSQL_HOST
         db_port = MYSQL_PORT
         db_user = MYSQL_USER
 
-    cmd = f"zcat {dump_file} | " \
-          f"/usr/bin/mysql --user={db_user} --host={db_host} --port={db_port} --password={db_pass} {db_name}"
+    if dump_file.endswith(ENCRYPTED_FILE_SUFFIX):
+        decompress = f"{make_encryption_stage('decrypt')} < {dump_file} | zcat"
+    else:
+        decompress = f"zcat {dump_file}"
+    mysql = make_mysql_command(password=db_pass, user=db_user, host=db_host, port=db_port, db_name=db_name)
+    cmd = f"{decompress} | {mysql}"
     logging.debug("import_db.cmd - %s", cmd)
-    return execute_command_in_bash(command=cmd)
+    f_name = __make_temp_bash()
+    execute_command_in_bash(command=cmd, f_name=f_name, check=check)
+    return f_name
+
+
+def copy_database(source_db, target_db, db_pass, check=False):
+    dump_file, export_db_sh = export_db(db_name=source_db, db_pass=db_pass, check=check)
+    import_db_sh = import_db(db_name=target_db, db_pass=db_pass, dump_file=dump_file, check=check)
+    return dump_file, export_db_sh, import_db_sh
 
 
 def copy_db():
@@ -693,11 +1905,9 @@ def copy_db():
     target_db = get_target_db_name()
     print(f"Database \"{source_db}\" will copy to \"{target_db}\"\n"
           f"Verify that database \"{target_db}\" exists on server!")
-    print(f"Are you ready to continue? Y(yes) or N(no)")
-    answer = __read_stdin().lower()
-    if answer in ("y", "yes"):
-        dump_file, export_db_sh = export_db_to_file(db_name=source_db, db_pass=password)
-        import_db_sh = import_db(db_name=target_db, db_pass=password, dump_file=dump_file)
+    if confirm("Are you ready to continue? Y(yes) or N(no)"):
+        dump_file, export_db_sh, import_db_sh = copy_database(source_db=source_db, target_db=target_db,
+                                                              db_pass=password)
         logging.warning("\n"
                         "Source database - \"%s\"; \nTarget database - \"%s\"\n"
                         "Verify that new copy is work properly!\n"
@@ -711,16 +1921,11 @@ def copy_db():
 
 
 def get_dump_file():
-    logging.info("Enter full path to dump file")
-    dump_file = __read_stdin()
-    if os.path.exists(dump_file):
-        return dump_file
-    else:
-        logging.error("Can not find dump file, please try again!")
-        get_dump_file()
+    return get_option("dump_file", "Enter full path to dump file", validate=os.path.exists,
+                      error="Can not find dump file, please try again!")
 
 
-def execute_procedure(db_host, db_port, db_name, db_user, db_pass, db_key, procedure_id="1"):
+def execute_procedure(db_host, db_port, db_name, db_user, db_pass, db_key, procedure_id="1", check=False):
     def __make_call_sql():
         f_name = f"/tmp/{generate_random_string()}.sql"
         with open(f_name, "w") as f:
@@ -732,9 +1937,30 @@ def execute_procedure(db_host, db_port, db_name, db_user, db_pass, db_key, proce
         return f_name
 
     sql_file = __make_call_sql()
-    cmd = f"/usr/bin/mysql --user={db_user} --host={db_host} --port={db_port} --password={db_pass} {db_name}" \
+    cmd = f"{make_mysql_command(password=db_pass, user=db_user, host=db_host, port=db_port, db_name=db_name)}" \
           f" < {sql_file}"
-    return sql_file, execute_command_in_bash(command=cmd)
+    f_name = __make_temp_bash()
+    execute_command_in_bash(command=cmd, f_name=f_name, check=check)
+    return sql_file, f_name
+
+
+def import_database(dump_file, db_name, db_pass, db_key, db_host="", db_port="", db_user="", check=False):
+    logging.info("Start import file %s to database %s", dump_file, db_name)
+    import_sh = import_db(db_host=db_host,
+                          db_port=db_port,
+                          db_name=db_name,
+                          db_user=db_user,
+                          db_pass=db_pass,
+                          dump_file=dump_file,
+                          check=check)
+    sql_f, sql_sh = execute_procedure(db_host=db_host or MYSQL_HOST,
+                                      db_port=db_port or MYSQL_PORT,
+                                      db_name=db_name,
+                                      db_user=db_user or MYSQL_USER,
+                                      db_pass=db_pass,
+                                      db_key=db_key,
+                                      check=check)
+    return import_sh, sql_f, sql_sh
 
 
 def import_db_from_file():
@@ -754,22 +1980,14 @@ def import_db_from_file():
           f"\tDatabase key: {db_key}")
     print(f"Verify that database \"{db_name}\" exists on server!")
     print(f"Verify that user \"{db_user}\" can create tables in database \"{db_name}\"!")
-    print(f"Are you ready to import? Y(yes) or N(no)")
-    answer = __read_stdin().lower()
-    if answer in ("y", "yes"):
-        logging.info("Start import file %s to database %s", dump_file, db_name)
-        import_sh = import_db(db_host=db_host,
-                              db_port=db_port,
-                              db_name=db_name,
-                              db_user=db_user,
-                              db_pass=db_pass,
-                              dump_file=dump_file)
-        sql_f, sql_sh = execute_procedure(db_host=db_host,
-                                          db_port=db_port,
-                                          db_name=db_name,
-                                          db_user=db_user,
-                                          db_pass=db_pass,
-                                          db_key=db_key)
+    if confirm("Are you ready to import? Y(yes) or N(no)"):
+        import_sh, sql_f, sql_sh = import_database(dump_file=dump_file,
+                                                   db_name=db_name,
+                                                   db_pass=db_pass,
+                                                   db_key=db_key,
+                                                   db_host=db_host,
+                                                   db_port=db_port,
+                                                   db_user=db_user)
         logging.warning(f"\n\nVerify that database imported successful and remove next files:\n"
                         f"\tImport shell script - {import_sh}\n"
                         f"\tDump file - {dump_file}\n"
@@ -792,26 +2010,105 @@ def export_db_to_file(db_name="", db_pass=""):
     return export_db(db_name=db_name, db_pass=db_pass)
 
 
+def get_job_option(job, key, default=None):
+    value = job.get(key, "")
+    if len(value) > 0:
+        return value
+    if default is not None:
+        return default
+    raise Exception(f"Option \"{key}\" is required")
+
+
+def get_job_password(job):
+    if len(job.get("password_file", "")) > 0:
+        return read_password_from_file(job["password_file"])
+    return get_job_option(job, "password")
+
+
+def run_job_action(job):
+    action = get_job_option(job, "action")
+    if action == "export":
+        dump_file, _ = export_db(db_name=get_job_option(job, "source_db"), db_pass=get_job_password(job),
+                                 destination_folder=get_job_option(job, "export_folder", ""), check=True)
+        return dump_file
+    elif action == "import":
+        import_database(dump_file=get_job_option(job, "dump_file"),
+                        db_name=get_job_option(job, "target_db"),
+                        db_pass=job.get("db_pass", "") or get_job_password(job),
+                        db_key=get_job_option(job, "db_key"),
+                        db_host=get_job_option(job, "db_host", ""),
+                        db_port=get_job_option(job, "db_port", ""),
+                        db_user=get_job_option(job, "db_user", ""),
+                        check=True)
+        return get_job_option(job, "target_db")
+    elif action == "copy":
+        dump_file, _, _ = copy_database(source_db=get_job_option(job, "source_db"),
+                                        target_db=get_job_option(job, "target_db"),
+                                        db_pass=get_job_password(job), check=True)
+        return dump_file
+    raise Exception(f"Action \"{action}\" does not support in batch")
+
+
+def run_job(name):
+    logging.info("Start job %s", name)
+    started = time.time()
+    try:
+        result = run_job_action(JOBS[name])
+        ok = True
+    except Exception as e:
+        logging.error("Job %s is failed - %s", name, e)
+        result = str(e)
+        ok = False
+    return {"name": name, "action": JOBS[name].get("action", ""), "ok": ok, "seconds": time.time() - started,
+            "result": result}
+
+
+def run_batch():
+    names = [x.strip() for x in OPTIONS.get("jobs", "").split(",") if len(x.strip()) > 0] or list(JOBS)
+    for x in names:
+        if x not in JOBS:
+            raise Exception(f"Can't find job \"{x}\" in config file")
+    workers = max(1, int(OPTIONS.get("workers", PARALLEL_THREAD_NUM)))
+    logging.info("Run %s jobs with %s workers", len(names), workers)
+    started = time.time()
+    with ThreadPool(workers) as pool:
+        results = pool.map(run_job, names)
+    lines = [f"{x['name']:<20} {x['action']:<8} {'OK' if x['ok'] else 'FAILED':<8} {x['seconds']:>10.1f} sec  "
+             f"{x['result']}" for x in results]
+    failed = len([x for x in results if x["ok"] is False])
+    logging.warning("\nBatch summary:\n%s\nJobs - %s, failed - %s, total time - %.1f sec", "\n".join(lines),
+                    len(results), failed, time.time() - started)
+    return failed == 0
+
+
 if __name__ == '__main__':
     args = read_args()
     configure_logger(arguments=args)
+    load_options(arguments=args)
     BIN_LOG_IN_SQL = f"/tmp/converted_mysql_bin_logs_{datetime_in_custom_format()}.sql"
 
     TODAY_DAY_OF_WEEK = get_day_of_week()
-    WEEKLY_BACKUP_PATH = f"{BACKUP_BASE_DIR}/{FULL_BACKUP_PREFIX}{get_full_backup_date()}"
-    FULL_BACKUP_PATH = get_full_backup_path()
-    INC_BACKUP_PATH_CURRENT = get_incremental_backup_path()
-    INC_BACKUP_PATH_PREVIOUS = get_previous_incremental_backup_path()
-    APPLY_BIN_LOG_FILE = None
+    BACKUP_PROFILE_NAME = ""
+    use_backup_profile(BACKUP_PROFILE_NAME)
     PURGE_BINARY_LOGS_FILE = None
-    CONVERTED_BINFILES_SQL = None
     MYSQL_DB_PATH_NEW = None
     RENAME_RESTORED_BACKUP_NEW = None
 
+    if args.action.lower() in ("backup", "restore") and check_backup_profiles() is False:
+        sys.exit(1)
+
     if args.action.lower() == "backup":
         logging.info("We are going to do database backup")
-        do_backup()
-        remove_old_backup()
+        backup_failed = False
+        for profile_name in get_backup_profile_names():
+            use_backup_profile(profile_name)
+            # Old backups are kept until new backup of profile is done
+            if do_backup() is False:
+                backup_failed = True
+                continue
+            remove_old_backup()
+        if backup_failed is True:
+            sys.exit(1)
     elif args.action.lower() == "restore":
         logging.info("We are going to do database restore")
         restore_databases()
@@ -819,13 +2116,10 @@ if __name__ == '__main__':
                         "Next steps:\n"
                         "Verify that your MySQL instance is work properly;\n"
                         "If your MySQL instance is work properly remove next files and folders:\n"
-                        "Bash script that apply converted mysqlbinlog files to DB - %s\n"
                         "Bash script to purge MySQL Binlog files - %s\n"
-                        "Converted to SQL MySQL binary logs - %s\n"
                         "Old MySQL instance - %s\n"
                         "Folder with previous full backup (before restoration) - %s",
-                        APPLY_BIN_LOG_FILE, PURGE_BINARY_LOGS_FILE, CONVERTED_BINFILES_SQL, MYSQL_DB_PATH_NEW,
-                        RENAME_RESTORED_BACKUP_NEW)
+                        PURGE_BINARY_LOGS_FILE, MYSQL_DB_PATH_NEW, RENAME_RESTORED_BACKUP_NEW)
     elif args.action.lower() == "copy":
         logging.info("Start COPY one database to another one")
         copy_db()
@@ -835,5 +2129,12 @@ if __name__ == '__main__':
     elif args.action.lower() == "import":
         logging.info("Start import database from file")
         import_db_from_file()
+    elif args.action.lower() in ("encrypt", "decrypt"):
+        transform_stream(action=args.action.lower(), source=sys.stdin.buffer, target=sys.stdout.buffer,
+                         key=read_encryption_key())
+    elif args.action.lower() == "batch":
+        logging.info("Start batch of jobs")
+        if run_batch() is False:
+            sys.exit(1)
     else:
         logging.error("Action \"%s\" does not support", args.action)